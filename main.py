@@ -6,6 +6,11 @@ import yaml
 import logging
 import base64
 import quopri
+import hashlib
+import json
+import re
+
+from reconcile import run_reconcile
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -151,10 +156,192 @@ def process_emails(config, output_dir, parsers):
     return True
 
 
+MANIFEST_FILENAME = ".extract_manifest.json"
+
+
+def file_digest(filepath, chunk_size=1024 * 1024):
+    """Compute SHA-256 of a file in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    """Load the extract manifest kept in output_dir, or an empty one."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict):
+            return manifest
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError) as e:
+        logging.warning(f"Ignoring unreadable extract manifest {manifest_path}: {e}")
+    return {"files": {}}
+
+
+def save_manifest(output_dir, manifest):
+    """Atomically write the extract manifest to output_dir."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def snapshot_dir(directory):
+    """Map file names in directory to a (mtime, size, inode) signature."""
+    snapshot = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Dot files are staging and set-aside files, not outputs
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                snapshot[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return snapshot
+
+
+def is_up_to_date(entry, filepath, stat, extract_dir, parser_versions):
+    """
+    Check whether a manifest entry still describes the input file and its outputs.
+
+    Size and mtime are compared first; the content hash is only computed
+    when the size matches but the mtime changed.
+    """
+    if parser_versions.get(entry.get("parser")) != entry.get("parser_version"):
+        return False
+    for output in entry.get("outputs", []):
+        if not os.path.exists(os.path.join(extract_dir, output)):
+            return False
+    if entry.get("size") != stat.st_size:
+        return False
+    if entry.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if entry.get("sha256") != file_digest(filepath):
+        return False
+    # Same content with a new mtime (e.g. touched or copied): refresh the stat info
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def set_aside_outputs(filename, entries, extract_dir):
+    """
+    Move the files a stale manifest entry produced out of the way, so the
+    re-extraction can write them under their original names. Files also
+    listed by another entry stay in place. Returns (original, aside) paths.
+    """
+    shared = set()
+    for other_name, other in entries.items():
+        if other_name != filename:
+            shared.update(other.get("outputs", []))
+    moved = []
+    for output in entries[filename].get("outputs", []):
+        if output in shared:
+            continue
+        original = os.path.join(extract_dir, output)
+        aside = os.path.join(extract_dir, f".{output}.prev")
+        try:
+            os.replace(original, aside)
+            moved.append((original, aside))
+        except FileNotFoundError:
+            pass
+    return moved
+
+
+def restore_outputs(moved):
+    """Put outputs moved by set_aside_outputs back after a failed re-extraction."""
+    for original, aside in moved:
+        try:
+            os.replace(aside, original)
+        except OSError as e:
+            logging.error(f"Failed to restore {original}: {e}")
+
+
+def drop_outputs(moved):
+    """Delete outputs moved by set_aside_outputs after a successful re-extraction."""
+    for original, aside in moved:
+        try:
+            os.remove(aside)
+            logging.info(f"Removed previous output {os.path.basename(original)}")
+        except OSError as e:
+            logging.error(f"Failed to remove previous output {aside}: {e}")
+
+
+def output_family(name):
+    """Strip a rename suffix: 'name_N.ext' -> 'name.ext'."""
+    m = re.match(r"^(.*)_\d+(\.[^.]*)?$", name)
+    return m.group(1) + (m.group(2) or "") if m else name
+
+
+def reuse_identical_outputs(outputs, before, extract_dir):
+    """
+    Replace renamed copies ('name_N.ext') with an identical file of the same
+    family ('name.ext', 'name_M.ext') that already existed. This happens when
+    an input without a manifest entry (first run, lost manifest) is
+    extracted again.
+    """
+    existing = {}
+    for name in before:
+        existing.setdefault(output_family(name), []).append(name)
+
+    result = set()
+    for name in outputs:
+        reused = None
+        new_path = os.path.join(extract_dir, name)
+        # Only renamed copies can duplicate an existing file
+        for candidate in existing.get(output_family(name), []) if name != output_family(name) else []:
+            candidate_path = os.path.join(extract_dir, candidate)
+            if (
+                candidate not in outputs
+                and candidate not in result
+                and os.path.getsize(candidate_path) == os.path.getsize(new_path)
+                and file_digest(candidate_path) == file_digest(new_path)
+            ):
+                reused = candidate
+                break
+        if reused:
+            os.remove(new_path)
+            logging.info(f"Reusing existing {reused} instead of identical copy {name}")
+            result.add(reused)
+        else:
+            result.add(name)
+    return sorted(result)
+
+
 def run_extract(output_dir, extract_dir, parsers, extra_params, keep_files=False):
-    """Run extract operation on files in output_dir."""
+    """
+    Run extract operation on files in output_dir.
+
+    Successfully extracted inputs that are kept are recorded in a manifest in
+    output_dir, so later runs skip them unless the input content, its outputs
+    or the parser version changed. When such an input is extracted again,
+    the outputs of its previous extraction are replaced on success and
+    restored on failure.
+    """
+    manifest = load_manifest(output_dir)
+    entries = manifest["files"]
+    parser_versions = {parser["name"]: parser.get("version") for parser in parsers}
+    original_entries = json.dumps(entries, sort_keys=True)
+    filenames = set()
+
     for filename in os.listdir(output_dir):
         filepath = os.path.join(output_dir, filename)
+        if filename == MANIFEST_FILENAME or not os.path.isfile(filepath):
+            continue
+        filenames.add(filename)
+
+        stat = os.stat(filepath)
+        entry = entries.get(filename)
+        if entry and is_up_to_date(entry, filepath, stat, extract_dir, parser_versions):
+            logging.debug(f"Skipping unchanged {filename}")
+            continue
+        previous = set_aside_outputs(filename, entries, extract_dir) if entry else []
+
+        before = snapshot_dir(extract_dir)
+        extracted = False
         for parser in parsers:
             supported, success = parser["extract"](
                 filepath, extract_dir, extra_params
@@ -169,15 +356,54 @@ def run_extract(output_dir, extract_dir, parsers, extra_params, keep_files=False
             
             # Extract successful, conditionally delete the original file
             if not keep_files:
+                entries.pop(filename, None)
+                extracted = True
                 try:
                     os.remove(filepath)
                     logging.info(f"Successfully extracted and deleted {filename}")
                 except OSError as e:
                     logging.error(f"Failed to delete {filename}: {e}")
             else:
-                logging.info(f"Successfully extracted {filename} (keeping original file)")
+                after = snapshot_dir(extract_dir)
+                outputs = reuse_identical_outputs(
+                    [name for name, signature in after.items() if before.get(name) != signature],
+                    before,
+                    extract_dir,
+                )
+                if outputs:
+                    extracted = True
+                    entries[filename] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "sha256": file_digest(filepath),
+                        "parser": parser["name"],
+                        "parser_version": parser.get("version"),
+                        "outputs": outputs,
+                    }
+                    logging.info(f"Successfully extracted {filename} (keeping original file)")
+                else:
+                    # e.g. every member was skipped by extract_collision: skip
+                    logging.warning(
+                        f"Extracting {filename} wrote no new files, it will be retried on the next run"
+                    )
             break
 
+        if extracted:
+            drop_outputs(previous)
+        else:
+            restore_outputs(previous)
+
+    # Forget inputs that are no longer in output_dir
+    for filename in list(entries):
+        if filename not in filenames:
+            del entries[filename]
+
+    if json.dumps(entries, sort_keys=True) != original_entries:
+        try:
+            save_manifest(output_dir, manifest)
+        except OSError as e:
+            logging.error(f"Failed to save extract manifest: {e}")
+
 
 def main():
     arg_parser = argparse.ArgumentParser(description="IMAP Email Reader and Parser")
@@ -205,12 +431,21 @@ def main():
         action="store_true",
         help="Only perform extract operation, skip email fetching and parsing",
     )
+    arg_parser.add_argument(
+        "-r",
+        "--reconcile",
+        action="store_true",
+        help="Only reconcile extracted Alipay/WeChat payments against CMBCC card charges",
+    )
     args = arg_parser.parse_args()
     
     # Validate that p and e parameters are not specified together
     if args.parse_only and args.extract_only:
         logging.error("Error: -p and -e parameters cannot be specified together")
         return
+    if args.reconcile and (args.parse_only or args.extract_only):
+        logging.error("Error: -r cannot be combined with -p or -e")
+        return
 
     # Get config file directory for resolving relative paths
     config_dir = os.path.dirname(os.path.abspath(args.config))
@@ -219,8 +454,8 @@ def main():
     with open(args.config, "r", encoding="utf-8") as f:
         config = yaml.safe_load(f)
 
-    # Validate required IMAP connection parameters (only needed if not extract-only)
-    if not args.extract_only:
+    # Validate required IMAP connection parameters (not needed for extract-only or reconcile)
+    if not args.extract_only and not args.reconcile:
         required_params = ["imap_server", "email_user", "email_pass"]
         missing_params = []
         
@@ -243,7 +478,11 @@ def main():
     parsers = load_parsers()
 
     # Execute based on parameters
-    if args.extract_only:
+    if args.reconcile:
+        # Only run reconciliation on already extracted files
+        logging.info("Running reconcile mode")
+        run_reconcile(extract_dir, extra_params)
+    elif args.extract_only:
         # Only run extract operation
         logging.info("Running extract-only mode")
         run_extract(output_dir, extract_dir, parsers, extra_params, args.keep)
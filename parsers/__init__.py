@@ -5,11 +5,12 @@ This package contains parsers for various email formats, each implementing a sta
 - match(subject, sender): Determine if email matches this parser
 - parse(msg, msg_id, output_dir): Parse email content
 - extract(filename, extract_dir, config): Extract file content
+- VERSION: Extract output version, bump it when extract() changes
 """
 
-from .parser_alipay import match as alipay_match, parse as alipay_parse, extract as alipay_extract
-from .parser_cmbcc import match as cmbcc_match, parse as cmbcc_parse, extract as cmbcc_extract
-from .parser_wechat import match as wechat_match, parse as wechat_parse, extract as wechat_extract
+from .parser_alipay import match as alipay_match, parse as alipay_parse, extract as alipay_extract, VERSION as alipay_version
+from .parser_cmbcc import match as cmbcc_match, parse as cmbcc_parse, extract as cmbcc_extract, VERSION as cmbcc_version
+from .parser_wechat import match as wechat_match, parse as wechat_parse, extract as wechat_extract, VERSION as wechat_version
 
 # All available parsers
 PARSERS = [
@@ -17,19 +18,22 @@ PARSERS = [
         "name": "支付宝",
         "match": alipay_match,
         "parse": alipay_parse,
-        "extract": alipay_extract
+        "extract": alipay_extract,
+        "version": alipay_version
     },
     {
         "name": "招商银行信用卡",
         "match": cmbcc_match,
         "parse": cmbcc_parse,
-        "extract": cmbcc_extract
+        "extract": cmbcc_extract,
+        "version": cmbcc_version
     },
     {
         "name": "微信支付",
         "match": wechat_match,
         "parse": wechat_parse,
-        "extract": wechat_extract
+        "extract": wechat_extract,
+        "version": wechat_version
     }
 ]
 
@@ -57,7 +61,7 @@ __all__ = [
     "get_parser_by_name", 
     "get_all_parsers",
     "find_matching_parser",
-    "alipay_match", "alipay_parse", "alipay_extract",
-    "cmbcc_match", "cmbcc_parse", "cmbcc_extract", 
-    "wechat_match", "wechat_parse", "wechat_extract"
+    "alipay_match", "alipay_parse", "alipay_extract", "alipay_version",
+    "cmbcc_match", "cmbcc_parse", "cmbcc_extract", "cmbcc_version", 
+    "wechat_match", "wechat_parse", "wechat_extract", "wechat_version"
 ]
@@ -0,0 +1,158 @@
+"""
+Archive extraction helpers shared by the ZIP based parsers.
+
+Members are streamed in blocks into temporary files created inside extract_dir
+and only renamed into place once the whole archive has been read successfully,
+so a wrong password or an oversized archive never leaves partial files behind.
+
+Options read from extra_params:
+- extract_collision: what to do when a target file already exists
+  ("rename" (default), "overwrite" or "skip")
+- max_extract_size: maximum number of bytes a single archive may expand to
+  (default 512 MiB, 0 disables the limit)
+"""
+
+import os
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_EXTRACT_SIZE = 512 * 1024 * 1024
+COLLISION_POLICIES = ("rename", "overwrite", "skip")
+
+
+class ExtractLimitError(Exception):
+    """Raised when an archive expands beyond the configured size limit."""
+
+
+def get_extract_options(config):
+    """Read collision policy and size limit from the parser config."""
+    collision = config.get("extract_collision", "rename")
+    if collision not in COLLISION_POLICIES:
+        raise ValueError(
+            f"Invalid extract_collision '{collision}', expected one of: {', '.join(COLLISION_POLICIES)}"
+        )
+    value = config.get("max_extract_size")
+    if value is None or value == "":
+        return collision, DEFAULT_MAX_EXTRACT_SIZE
+    try:
+        max_size = int(value)
+    except (TypeError, ValueError):
+        max_size = -1
+    if max_size < 0:
+        raise ValueError(
+            f"Invalid max_extract_size '{value}', expected a number of bytes (0 disables the limit)"
+        )
+    return collision, max_size
+
+
+def _default_file_mode():
+    """Permission bits a regular open() would have used under the current umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _renamed_path(path, taken):
+    """Find a free 'name_N.ext' variant of path."""
+    root, ext = os.path.splitext(path)
+    counter = 1
+    while True:
+        candidate = f"{root}_{counter}{ext}"
+        if candidate not in taken and not os.path.exists(candidate):
+            return candidate
+        counter += 1
+
+
+class StagedExtraction:
+    """
+    Collects archive members as temporary files in extract_dir and moves them
+    to their final names on commit(). Anything not committed is removed when
+    the context manager exits.
+    """
+
+    def __init__(self, extract_dir, prefix, collision="rename", max_size=DEFAULT_MAX_EXTRACT_SIZE):
+        self.extract_dir = extract_dir
+        self.prefix = prefix
+        self.collision = collision
+        self.max_size = max_size
+        self.total_size = 0
+        self.staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.discard()
+        return False
+
+    def check_declared_size(self, size):
+        """Reject an archive up front when its declared size is over the limit."""
+        if self.max_size and size > self.max_size:
+            raise ExtractLimitError(
+                f"archive declares {size} bytes, limit is {self.max_size} bytes"
+            )
+
+    def add(self, member_name, stream):
+        """Stream one member from a file-like object into a temporary file, return its size."""
+        fd, temp_path = tempfile.mkstemp(dir=self.extract_dir, prefix=".extract-", suffix=".part")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.total_size += len(chunk)
+                    if self.max_size and self.total_size > self.max_size:
+                        raise ExtractLimitError(
+                            f"archive expands beyond the limit of {self.max_size} bytes"
+                        )
+                    out.write(chunk)
+                    written += len(chunk)
+            os.chmod(temp_path, _default_file_mode())
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        final_name = f"{self.prefix}{os.path.basename(member_name)}"
+        self.staged.append((member_name, temp_path, final_name))
+        return written
+
+    def commit(self):
+        """
+        Rename staged files into place. The collision policy applies to files
+        that existed before this archive; members of the same archive that
+        share a name are always renamed so each one is written once.
+        """
+        written = []
+        taken = set()
+        staged, self.staged = self.staged, []
+        for i, (member_name, temp_path, final_name) in enumerate(staged):
+            try:
+                target = os.path.join(self.extract_dir, final_name)
+                if target in taken:
+                    target = _renamed_path(target, taken)
+                elif os.path.exists(target):
+                    if self.collision == "skip":
+                        os.remove(temp_path)
+                        print(f"  Skipped existing file: {final_name}")
+                        continue
+                    if self.collision == "rename":
+                        target = _renamed_path(target, taken)
+                os.replace(temp_path, target)
+            except BaseException:
+                # Put the remaining files back so they get cleaned up
+                self.staged = staged[i:]
+                raise
+            taken.add(target)
+            written.append(target)
+            print(f"  Extracted file: {member_name} -> {os.path.basename(target)}")
+        return written
+
+    def discard(self):
+        """Remove staged files that have not been committed."""
+        for _, temp_path, _ in self.staged:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+        self.staged = []
@@ -1,11 +1,16 @@
 import os
 import zipfile
-import shutil
-import tempfile
+import zlib
 import email.header
 import base64
 import re
 
+from .archive import StagedExtraction, ExtractLimitError, get_extract_options
+
+
+# Bump when extract() output changes so kept inputs are re-extracted
+VERSION = 1
+
 
 def match(subject, sender):
     return "支付宝" in (subject or "") or "支付宝" in (sender or "")
@@ -85,30 +90,28 @@ def extract(filename, extract_dir, config):
         # Try passwords from back to front
         passwords.reverse()
         
-        # Try to extract zip file
+        collision, max_size = get_extract_options(config)
+
+        # Try to extract zip file, streaming members straight into extract_dir
         with zipfile.ZipFile(filename, 'r') as zip_ref:
+            members = [info for info in zip_ref.infolist() if not info.is_dir()]
             for password in passwords:
                 try:
-                    # Create temporary directory
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        # Try to extract to temporary directory with password
-                        zip_ref.extractall(temp_dir, pwd=password.encode('utf-8'))
+                    with StagedExtraction(extract_dir, "alipay_", collision, max_size) as staging:
+                        staging.check_declared_size(sum(info.file_size for info in members))
+                        for info in members:
+                            with zip_ref.open(info, pwd=password.encode('utf-8')) as src:
+                                staging.add(info.filename, src)
                         print(f"  Successfully extracted with password: {password}")
-                        
-                        # Move files from temporary directory to extract_dir and add "alipay_" prefix
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                old_path = os.path.join(root, file)
-                                new_name = f"alipay_{file}"
-                                new_path = os.path.join(extract_dir, new_name)
-                                shutil.move(old_path, new_path)
-                                print(f"  Moved file: {file} -> {new_name}")
-                        
+                        staging.commit()
                         return True, True
-                    
-                except (zipfile.BadZipFile, RuntimeError):
+
+                except (zipfile.BadZipFile, RuntimeError, zlib.error):
                     # Wrong password, continue trying next one
                     continue
+                except ExtractLimitError as e:
+                    print(f"  Refusing to extract {filename}: {e}")
+                    return True, False
         
         # All password attempts failed
         print(f"  Failed to extract zip file: {filename} - no valid password found")
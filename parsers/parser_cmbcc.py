@@ -5,6 +5,10 @@ import re
 from bs4 import BeautifulSoup
 
 
+# Bump when extract() output changes so kept inputs are re-extracted
+VERSION = 1
+
+
 def match(subject, sender):
     return "招商银行信用卡" in (subject or "") or "招商银行信用卡" in (sender or "")
 
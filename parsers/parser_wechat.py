@@ -2,10 +2,15 @@ import os
 import re
 import requests
 import shutil
-import tempfile
 import subprocess
 from urllib.parse import unquote
 
+from .archive import StagedExtraction, ExtractLimitError, get_extract_options
+
+
+# Bump when extract() output changes so kept inputs are re-extracted
+VERSION = 1
+
 
 def match(subject, sender):
     return "微信支付" in (sender or "") or "微信支付" in (subject or "")
@@ -71,6 +76,62 @@ def parse(msg, msg_id, output_dir):
         return False
 
 
+def list_members(seven_zip_path, filename, password):
+    """
+    List regular files in the archive as (path, size), or None if 7zip fails.
+    size is None when the listing does not report it.
+    """
+    result = subprocess.run([
+        seven_zip_path, "l", "-slt", f"-p{password}", "--", filename
+    ], capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        return None
+
+    members = []
+    # Technical listing: archive properties, a "----------" line, then one block per entry
+    listing = result.stdout.split("----------", 1)
+    if len(listing) < 2:
+        return members
+    for block in re.split(r"\n\s*\n", listing[1]):
+        props = {}
+        for line in block.splitlines():
+            key, sep, value = line.partition(" = ")
+            if sep:
+                props[key.strip()] = value
+        if "Path" not in props:
+            continue
+        if props.get("Folder") == "+" or props.get("Attributes", "").startswith("D"):
+            continue
+        size = props.get("Size", "")
+        members.append((props["Path"], int(size) if size.isdigit() else None))
+    return members
+
+
+def extract_member(seven_zip_path, filename, password, member, size, staging):
+    """
+    Stream a single member from 7zip's stdout into the staging area.
+
+    7zip exits successfully even when the member name selects nothing, so the
+    number of bytes streamed is also checked against the listed size.
+    """
+    process = subprocess.Popen([
+        seven_zip_path, "x", "-so", "-spd", f"-p{password}", "--", filename, member
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        written = staging.add(member, process.stdout)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        return False
+    if size is not None and written != size:
+        print(f"  Size mismatch for {member}: expected {size} bytes, got {written}")
+        return False
+    return True
+
+
 def extract(filename, extract_dir, config):
     # Check if filename meets the conditions
     base_filename = os.path.basename(filename)
@@ -101,32 +162,28 @@ def extract(filename, extract_dir, config):
         # Try passwords from back to front
         passwords.reverse()
         
-        # Try to extract zip file using 7zip
+        collision, max_size = get_extract_options(config)
+
+        # Try to extract zip file using 7zip, streaming members straight into extract_dir
         for password in passwords:
+            members = list_members(seven_zip_path, filename, password)
+            if members is None:
+                continue
+
             try:
-                # Create temporary directory
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    # Try to extract to temporary directory with password using 7zip
-                    result = subprocess.run([
-                        seven_zip_path, "x", filename, f"-o{temp_dir}", "-y", f"-p{password}"
-                    ], capture_output=True, text=True, encoding='utf-8')
-                    
-                    if result.returncode == 0:
+                with StagedExtraction(extract_dir, "wechat_", collision, max_size) as staging:
+                    staging.check_declared_size(sum(size or 0 for _, size in members))
+                    for member, size in members:
+                        if not extract_member(seven_zip_path, filename, password, member, size, staging):
+                            break
+                    else:
                         print(f"  Successfully extracted with password: {password}")
-                        
-                        # Move files from temporary directory to extract_dir and add "wechat_" prefix
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                old_path = os.path.join(root, file)
-                                new_name = f"wechat_{file}"
-                                new_path = os.path.join(extract_dir, new_name)
-                                shutil.move(old_path, new_path)
-                                print(f"  Moved file: {file} -> {new_name}")
-                        
+                        staging.commit()
                         return True, True
-                    else:
-                        continue
-                    
+
+            except ExtractLimitError as e:
+                print(f"  Refusing to extract {filename}: {e}")
+                return True, False
             except Exception as e:
                 print(f"  Error extracting WeChat zip file with password {password}: {e}")
                 continue
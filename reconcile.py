@@ -0,0 +1,464 @@
+"""
+Cross-source reconciliation of wallet payments against card charges.
+
+Alipay and WeChat Pay transactions paid with the CMB credit card appear both
+in the wallet exports (alipay_*.csv, wechat_*.xlsx / wechat_*.csv) and in the
+card statements (cmbcc_YYYY_MM.csv) with a "支付宝-" / "财付通-" summary.
+
+Both sides are hash-indexed by (source, amount) and each bucket is matched
+with a sorted merge on date, so every wallet payment only looks at charges
+with the same amount inside the date window (bisect) instead of comparing
+every row with every other row. Charges whose summary names the payment's
+counterparty are paired first.
+"""
+
+import bisect
+import csv
+import datetime
+import glob
+import io
+import logging
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+DEFAULT_WINDOW_DAYS = 3
+DEFAULT_CARD_KEYWORD = "招商银行"
+
+SOURCE_NAMES = {"alipay": "支付宝", "wechat": "微信支付"}
+
+# Card statement summaries that point back to a wallet payment
+CARD_SUMMARY_PREFIXES = (("支付宝", "alipay"), ("财付通", "wechat"))
+
+# Column names used by the wallet exports, first match wins
+WALLET_COLUMNS = {
+    "time": ("交易时间",),
+    "counterparty": ("交易对方",),
+    "item": ("商品说明", "商品"),
+    "direction": ("收/支",),
+    "amount": ("金额", "金额(元)"),
+    "method": ("收/付款方式", "支付方式"),
+    "status": ("交易状态", "当前状态"),
+    "order_id": ("交易订单号", "交易单号"),
+}
+
+MATCHED_FILENAME = "reconcile_matched.csv"
+AMBIGUOUS_FILENAME = "reconcile_ambiguous.csv"
+UNMATCHED_FILENAME = "reconcile_unmatched.csv"
+
+PAIR_HEADER = [
+    "来源", "钱包交易时间", "交易对方", "商品", "金额", "支付方式", "交易单号",
+    "信用卡交易日", "交易摘要", "卡号末四位", "相差天数", "钱包文件", "信用卡文件",
+]
+UNMATCHED_HEADER = ["类型", "来源", "日期", "金额", "说明", "卡号末四位", "文件"]
+
+
+def parse_amount(value):
+    """Convert an amount like '¥1,234.50' to integer cents, or None."""
+    if value is None:
+        return None
+    text = str(value).replace("¥", "").replace("￥", "").replace(",", "").strip()
+    try:
+        return int((Decimal(text) * 100).to_integral_value())
+    except (InvalidOperation, ValueError, OverflowError):
+        # Decimal accepts "NaN" and "Infinity", which int() rejects
+        return None
+
+
+def parse_date(value):
+    """Parse the date part of a wallet transaction time."""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    m = re.search(r"(\d{4})[-/年.](\d{1,2})[-/月.](\d{1,2})", str(value or ""))
+    if not m:
+        return None
+    try:
+        return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+
+
+def parse_card_date(value, year, month):
+    """Parse a CMBCC 交易日 ('MMDD') using the statement year and month."""
+    digits = re.sub(r"\D", "", value or "")
+    try:
+        if len(digits) == 8:
+            return datetime.date(int(digits[:4]), int(digits[4:6]), int(digits[6:]))
+        if len(digits) == 4:
+            trans_month, day = int(digits[:2]), int(digits[2:])
+            # Transactions from December show up on the January statement
+            trans_year = year - 1 if trans_month > month else year
+            return datetime.date(trans_year, trans_month, day)
+    except ValueError:
+        pass
+    return None
+
+
+def format_amount(cents):
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+def card_last4(text):
+    """Get card last four digits from a payment method like '招商银行信用卡(1234)'."""
+    m = re.search(r"[(（](\d{4})[)）]", text or "")
+    return m.group(1) if m else None
+
+
+def read_table_rows(filepath):
+    """Read all rows of a CSV or XLSX export as lists of strings/values."""
+    if filepath.endswith(".xlsx"):
+        try:
+            import openpyxl
+        except ImportError:
+            logging.warning(f"openpyxl is not installed, skipping {os.path.basename(filepath)}")
+            return []
+        workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            return [list(row) for row in sheet.iter_rows(values_only=True)]
+        finally:
+            workbook.close()
+
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    # Alipay exports are GBK encoded, extracted CMBCC files are UTF-8
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = raw.decode("utf-8", errors="ignore")
+    return list(csv.reader(io.StringIO(text)))
+
+
+def load_wallet_rows(filepath, source, card_keyword):
+    """Load card-paid expense rows from a wallet export."""
+    rows = read_table_rows(filepath)
+    header_index = None
+    for i, row in enumerate(rows):
+        cells = [str(cell or "").strip() for cell in row]
+        if "交易时间" in cells and any(name in cells for name in WALLET_COLUMNS["amount"]):
+            header_index = i
+            break
+    if header_index is None:
+        logging.warning(f"No transaction header found in {os.path.basename(filepath)}")
+        return []
+
+    header = [str(cell or "").strip() for cell in rows[header_index]]
+    columns = {}
+    for key, names in WALLET_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[key] = header.index(name)
+                break
+
+    def cell(row, key):
+        index = columns.get(key)
+        if index is None or index >= len(row) or row[index] is None:
+            return ""
+        return str(row[index]).strip()
+
+    result = []
+    for row in rows[header_index + 1:]:
+        if cell(row, "direction") != "支出":
+            continue
+        method = cell(row, "method")
+        if card_keyword not in method or "关闭" in cell(row, "status"):
+            continue
+        index = columns.get("time")
+        date = parse_date(row[index] if index is not None and index < len(row) else None)
+        amount = parse_amount(cell(row, "amount"))
+        if date is None or amount is None:
+            continue
+        result.append({
+            "source": source,
+            "date": date,
+            "time": cell(row, "time"),
+            "counterparty": cell(row, "counterparty"),
+            "item": cell(row, "item"),
+            "amount": amount,
+            "method": method,
+            "last4": card_last4(method),
+            "order_id": cell(row, "order_id"),
+            "file": os.path.basename(filepath),
+        })
+    return result
+
+
+def load_card_rows(filepath):
+    """Load wallet-related charges from an extracted CMBCC statement."""
+    base_filename = os.path.basename(filepath)
+    m = re.match(r"cmbcc_(\d{4})_(\d{2})\.csv$", base_filename)
+    if not m:
+        logging.warning(f"Cannot determine statement month of {base_filename}, skipping")
+        return []
+    year, month = int(m.group(1)), int(m.group(2))
+
+    result = []
+    with open(filepath, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            summary = (row.get("交易摘要") or "").strip()
+            source = None
+            for prefix, name in CARD_SUMMARY_PREFIXES:
+                if summary.startswith(prefix):
+                    source = name
+                    break
+            if source is None:
+                continue
+            date = parse_card_date(row.get("交易日"), year, month)
+            amount = parse_amount(row.get("人民币金额"))
+            # Refunds and repayments are negative and have no wallet payment
+            if date is None or amount is None or amount <= 0:
+                continue
+            result.append({
+                "source": source,
+                "date": date,
+                "summary": summary,
+                "amount": amount,
+                "last4": (row.get("卡号末四位") or "").strip() or None,
+                "file": base_filename,
+            })
+    return result
+
+
+def dedupe_wallet_rows(wallet_rows):
+    """
+    Drop wallet rows seen more than once, e.g. from overlapping exports.
+    Rows are identified by order id, or by time and amount without one.
+    """
+    seen = set()
+    result = []
+    for row in wallet_rows:
+        if row["order_id"]:
+            key = (row["source"], row["order_id"])
+        else:
+            key = (row["source"], row["time"], row["amount"])
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(row)
+    return result
+
+
+def names_match(wallet, card):
+    """Whether the card summary mentions the wallet counterparty."""
+    return bool(wallet["counterparty"]) and wallet["counterparty"] in card["summary"]
+
+
+def cards_compatible(wallet, card):
+    """A payment and a charge can only match when their known card digits agree."""
+    return not (wallet["last4"] and card["last4"] and wallet["last4"] != card["last4"])
+
+
+def match_bucket(wallets, cards, window_days):
+    """
+    Pair the wallet payments and card charges of one (source, amount) bucket.
+
+    First every payment takes the earliest free charge in its window whose
+    summary names the counterparty. The remaining payments then take the
+    earliest free charge in their window. If that charge is tied with
+    same-day charges that have different summaries, the payment, the
+    following same-day payments and all tied charges form one ambiguous
+    group. Every row ends up in exactly one of the results.
+
+    Returns (matched, ambiguous_groups, unmatched_wallet, unmatched_card);
+    an ambiguous group is a (wallets, cards) pair.
+    """
+    wallets = sorted(wallets, key=lambda row: (row["date"], row["time"]))
+    cards = sorted(cards, key=lambda row: row["date"])
+    card_days = [card["date"].toordinal() for card in cards]
+    assigned = [False] * len(cards)
+
+    def free_cards(wallet, named):
+        day = wallet["date"].toordinal()
+        start = bisect.bisect_left(card_days, day - window_days)
+        end = bisect.bisect_right(card_days, day + window_days)
+        return [
+            i for i in range(start, end)
+            if not assigned[i]
+            and cards_compatible(wallet, cards[i])
+            and (not named or names_match(wallet, cards[i]))
+        ]
+
+    matched = []
+    pending = []
+    for wallet in wallets:
+        found = free_cards(wallet, named=True)
+        if found:
+            assigned[found[0]] = True
+            matched.append((wallet, cards[found[0]]))
+        else:
+            pending.append(wallet)
+
+    groups = []
+    unmatched_wallet = []
+    i = 0
+    while i < len(pending):
+        wallet = pending[i]
+        i += 1
+        found = free_cards(wallet, named=False)
+        if not found:
+            unmatched_wallet.append(wallet)
+            continue
+        tied = [j for j in found if card_days[j] == card_days[found[0]]]
+        if len({cards[j]["summary"] for j in tied}) == 1:
+            assigned[found[0]] = True
+            matched.append((wallet, cards[found[0]]))
+            continue
+        group_wallets = [wallet]
+        while (
+            i < len(pending)
+            and len(group_wallets) < len(tied)
+            and pending[i]["date"] == wallet["date"]
+            and all(cards_compatible(pending[i], cards[j]) for j in tied)
+        ):
+            group_wallets.append(pending[i])
+            i += 1
+        for j in tied:
+            assigned[j] = True
+        groups.append((group_wallets, [cards[j] for j in tied]))
+
+    unmatched_card = [card for card, taken in zip(cards, assigned) if not taken]
+    return matched, groups, unmatched_wallet, unmatched_card
+
+
+def reconcile(wallet_rows, card_rows, window_days=DEFAULT_WINDOW_DAYS):
+    """
+    Link wallet payments to card charges with the same source and amount whose
+    dates are at most window_days apart, see match_bucket().
+
+    Returns (matched, ambiguous, unmatched_wallet, unmatched_card). matched is a
+    list of (wallet, card) pairs, ambiguous a list of (group, wallet, card)
+    candidate pairs.
+    """
+    # Hash index on (source, amount), holding the wallet rows and card rows
+    buckets = {}
+    for wallet in wallet_rows:
+        buckets.setdefault((wallet["source"], wallet["amount"]), ([], []))[0].append(wallet)
+    for card in card_rows:
+        buckets.setdefault((card["source"], card["amount"]), ([], []))[1].append(card)
+
+    matched = []
+    ambiguous = []
+    unmatched_wallet = []
+    unmatched_card = []
+    group_id = 0
+    for wallets, cards in buckets.values():
+        bucket_matched, groups, bucket_wallet, bucket_card = match_bucket(wallets, cards, window_days)
+        matched.extend(bucket_matched)
+        unmatched_wallet.extend(bucket_wallet)
+        unmatched_card.extend(bucket_card)
+        for group_wallets, group_cards in groups:
+            group_id += 1
+            for wallet in group_wallets:
+                for card in group_cards:
+                    ambiguous.append((group_id, wallet, card))
+
+    return matched, ambiguous, unmatched_wallet, unmatched_card
+
+
+def pair_row(wallet, card):
+    return [
+        SOURCE_NAMES[wallet["source"]],
+        wallet["time"],
+        wallet["counterparty"],
+        wallet["item"],
+        format_amount(wallet["amount"]),
+        wallet["method"],
+        wallet["order_id"],
+        card["date"].isoformat(),
+        card["summary"],
+        card["last4"] or "",
+        (card["date"] - wallet["date"]).days,
+        wallet["file"],
+        card["file"],
+    ]
+
+
+def write_csv(filepath, header, rows):
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def get_reconcile_options(extra_params):
+    """Read date window and card keyword from extra_params."""
+    value = extra_params.get("reconcile_window_days")
+    if value is None or value == "":
+        window_days = DEFAULT_WINDOW_DAYS
+    else:
+        try:
+            window_days = int(value)
+        except (TypeError, ValueError):
+            window_days = -1
+        if window_days < 0:
+            raise ValueError(
+                f"Invalid reconcile_window_days '{value}', expected a number of days (0 or more)"
+            )
+    card_keyword = extra_params.get("reconcile_card_keyword") or DEFAULT_CARD_KEYWORD
+    return window_days, card_keyword
+
+
+def run_reconcile(extract_dir, extra_params):
+    """Reconcile extracted wallet exports against CMBCC statements in extract_dir."""
+    try:
+        window_days, card_keyword = get_reconcile_options(extra_params)
+    except ValueError as e:
+        logging.error(str(e))
+        return False
+
+    wallet_rows = []
+    for source, patterns in (("alipay", ("alipay_*.csv",)), ("wechat", ("wechat_*.xlsx", "wechat_*.csv"))):
+        for pattern in patterns:
+            for filepath in sorted(glob.glob(os.path.join(extract_dir, pattern))):
+                wallet_rows.extend(load_wallet_rows(filepath, source, card_keyword))
+    loaded = len(wallet_rows)
+    wallet_rows = dedupe_wallet_rows(wallet_rows)
+    if len(wallet_rows) < loaded:
+        logging.info(f"Dropped {loaded - len(wallet_rows)} duplicate wallet payments")
+
+    card_rows = []
+    for filepath in sorted(glob.glob(os.path.join(extract_dir, "cmbcc_*.csv"))):
+        card_rows.extend(load_card_rows(filepath))
+
+    logging.info(
+        f"Reconciling {len(wallet_rows)} wallet payments against {len(card_rows)} card charges "
+        f"(window: {window_days} days)"
+    )
+    matched, ambiguous, unmatched_wallet, unmatched_card = reconcile(
+        wallet_rows, card_rows, window_days
+    )
+
+    write_csv(
+        os.path.join(extract_dir, MATCHED_FILENAME),
+        PAIR_HEADER,
+        [pair_row(wallet, card) for wallet, card in matched],
+    )
+    write_csv(
+        os.path.join(extract_dir, AMBIGUOUS_FILENAME),
+        ["组"] + PAIR_HEADER,
+        [[group_id] + pair_row(wallet, card) for group_id, wallet, card in ambiguous],
+    )
+    unmatched_rows = [
+        ["钱包", SOURCE_NAMES[row["source"]], row["date"].isoformat(), format_amount(row["amount"]),
+         f"{row['counterparty']} {row['item']}".strip(), row["last4"] or "", row["file"]]
+        for row in unmatched_wallet
+    ] + [
+        ["信用卡", SOURCE_NAMES[row["source"]], row["date"].isoformat(), format_amount(row["amount"]),
+         row["summary"], row["last4"] or "", row["file"]]
+        for row in unmatched_card
+    ]
+    write_csv(os.path.join(extract_dir, UNMATCHED_FILENAME), UNMATCHED_HEADER, unmatched_rows)
+
+    logging.info(
+        f"Reconcile finished: {len(matched)} matched, "
+        f"{len({group_id for group_id, _, _ in ambiguous})} ambiguous groups, "
+        f"{len(unmatched_wallet)} unmatched wallet payments, {len(unmatched_card)} unmatched card charges"
+    )
+    return True